@@ -11,14 +11,57 @@ Variables de entorno requeridas:
   GH_REPO_NAME      - Nombre del repo (ej: base_project)
   FUNCTION_URL      - URL pública de esta Cloud Function
   ACTION_SECRET     - (Opcional) Secret compartido para validar requests de Looker
+  ASYNC_DISPATCH    - (Opcional) "1" para disparar el workflow tras responder a Looker;
+                      solo con CPU siempre asignada (ver "Despliegue")
+  LOG_LEVEL         - (Opcional) Nivel de log (por defecto INFO, también si no es válido;
+                      DEBUG loguea cada request)
+
+Despliegue (con al menos una instancia caliente para que Looker no pague
+el cold start al descubrir la acción; usar --min-instances=0 fuera de prod):
+  gcloud functions deploy looker_action \\
+    --gen2 --runtime=python311 --trigger-http --allow-unauthenticated \\
+    --entry-point=looker_action --source=cloud_function \\
+    --min-instances=1 --max-instances=10 \\
+    --memory=128Mi --cpu=0.083
+
+La función solo hace un POST saliente, así que el tier mínimo basta; subir
+a 256Mi solo si se llega a usar el Looker SDK desde aquí.
+
+Por defecto el dispatch a GitHub es síncrono: con --cpu=0.083 la CPU se
+estrangula al responder y un hilo en segundo plano quedaría congelado o se
+perdería al escalar hacia abajo. Para responder a Looker antes de llamar a
+GitHub hace falta CPU siempre asignada, que en Cloud Run exige 1 vCPU y
+sustituye al tier de 0.083:
+  gcloud functions deploy looker_action ... --cpu=1 --update-env-vars=ASYNC_DISPATCH=1
+  gcloud run services update looker-action --no-cpu-throttling
+El segundo comando actúa sobre el servicio de Cloud Run subyacente y un
+nuevo `gcloud functions deploy` puede revertirlo, así que hay que repetirlo
+tras cada despliegue (o quitar ASYNC_DISPATCH).
 """
 
-import json
+import logging
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import functions_framework
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+
+    def _json_dumps(data) -> bytes:
+        return json.dumps(data).encode()
+
+    _json_loads = json.loads
 
 
 # --- Config ---
@@ -26,27 +69,80 @@ GH_TOKEN = os.environ.get("GH_TOKEN", "")
 GH_REPO_OWNER = os.environ.get("GH_REPO_OWNER", "")
 GH_REPO_NAME = os.environ.get("GH_REPO_NAME", "")
 ACTION_SECRET = os.environ.get("ACTION_SECRET", "")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+if LOG_LEVEL not in logging.getLevelNamesMapping():
+    LOG_LEVEL = "INFO"
 FUNCTION_URL = os.environ.get("FUNCTION_URL", "").rstrip("/")
+ASYNC_DISPATCH = os.environ.get("ASYNC_DISPATCH", "").lower() in ("1", "true", "yes")
 
 WORKFLOW_FILE = "update_dashboard.yml"
+_GH_DISPATCH_URL = (
+    f"https://api.github.com/repos/{GH_REPO_OWNER}/{GH_REPO_NAME}"
+    f"/actions/workflows/{WORKFLOW_FILE}/dispatches"
+)
+
+logging.basicConfig(stream=sys.stderr, format="%(message)s")
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+
+# Tope de espera por Retry-After: urllib3 duerme el valor que mande GitHub sin
+# límite (60 s en el rate limit secundario), y Looker espera en el camino síncrono.
+_RETRY_AFTER_MAX = 5
+
+
+class _CappedRetry(Retry):
+    """Retry que no espera más de _RETRY_AFTER_MAX segundos por Retry-After."""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, _RETRY_AFTER_MAX)
+
+
+# Sesión HTTP compartida entre invocaciones (instancias calientes reutilizan
+# las conexiones keep-alive con api.github.com en vez de repetir TCP+TLS).
+SESSION = requests.Session()
+SESSION.headers.update({
+    "Accept": "application/vnd.github.v3+json",
+    "Authorization": f"Bearer {GH_TOKEN}",
+})
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    # El dispatch no es idempotente: cada POST aceptado lanza un workflow que
+    # hace commit y push. Solo se reintenta lo que GitHub seguro no encoló
+    # (fallo de conexión, 429, 503); nunca un timeout de lectura ni 502/504,
+    # que pueden llegar con el run ya creado.
+    max_retries=_CappedRetry(
+        total=2,
+        read=0,
+        backoff_factor=0.5,
+        backoff_jitter=0.25,
+        status_forcelist=(429, 503),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+        allowed_methods=frozenset(["POST"]),
+    ),
+))
 
 
 def trigger_github_workflow(dashboard_id: str) -> dict:
     """Dispara el workflow de GitHub Actions via la API."""
-    url = (
-        f"https://api.github.com/repos/{GH_REPO_OWNER}/{GH_REPO_NAME}"
-        f"/actions/workflows/{WORKFLOW_FILE}/dispatches"
-    )
-    headers = {
-        "Accept": "application/vnd.github.v3+json",
-        "Authorization": f"Bearer {GH_TOKEN}",
-    }
     payload = {
         "ref": "main",
         "inputs": {"dashboard_id": str(dashboard_id)},
     }
 
-    resp = requests.post(url, headers=headers, json=payload, timeout=15)
+    # (connect, read) por intento; con 2 reintentos y Retry-After acotado el
+    # peor caso queda en ~35 s (3 × 8 s + 2 × _RETRY_AFTER_MAX), por debajo
+    # del timeout de 60 s por defecto de la función
+    resp = SESSION.post(_GH_DISPATCH_URL, json=payload, timeout=(3.05, 5))
+    logger.info(
+        "[GITHUB] dispatch %s | rate limit remaining: %s",
+        resp.status_code,
+        resp.headers.get("X-RateLimit-Remaining", "?"),
+    )
 
     if resp.status_code == 204:
         return {"ok": True, "message": f"Workflow disparado para dashboard {dashboard_id}"}
@@ -57,18 +153,43 @@ def trigger_github_workflow(dashboard_id: str) -> dict:
         }
 
 
+# Dispatch en segundo plano (solo con ASYNC_DISPATCH): Looker recibe la
+# respuesta sin esperar a GitHub. Los fallos solo quedan en Cloud Logging, no
+# en la UI de Looker. Requiere CPU asignada fuera del request (ver "Despliegue").
+_DISPATCH_MAX_WORKERS = 4
+_DISPATCH_EXECUTOR = ThreadPoolExecutor(max_workers=_DISPATCH_MAX_WORKERS)
+_DISPATCH_SLOTS = threading.BoundedSemaphore(_DISPATCH_MAX_WORKERS)
+
+
+def _dispatch_in_background(dashboard_id: str) -> None:
+    """Dispara el workflow y registra el resultado (ejecutado en el executor)."""
+    try:
+        result = trigger_github_workflow(dashboard_id)
+        if result["ok"]:
+            logger.info("[GITHUB] %s", result["message"])
+        else:
+            logger.error("[GITHUB] %s", result["message"])
+    except Exception as e:
+        logger.error("[GITHUB] ERROR dispatching dashboard %s: %s", dashboard_id, e)
+    finally:
+        _DISPATCH_SLOTS.release()
+
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
 def _json_response(data, status=200):
     """Helper para devolver JSON con headers correctos."""
     return (
-        json.dumps(data),
+        _json_dumps(data),
         status,
-        {"Content-Type": "application/json"},
+        _JSON_HEADERS,
     )
 
 
-def _action_list():
-    """Devuelve el listado de acciones disponibles (descubrimiento)."""
-    return _json_response({
+def _action_list_payload(base_url: str) -> dict:
+    """Construye el listado de acciones apuntando a la URL base indicada."""
+    return {
         "label": "LookML Dashboard Updater",
         "integrations": [
             {
@@ -77,38 +198,75 @@ def _action_list():
                 "description": "Importa el LookML de este dashboard, limpia id/slug y reemplaza el modelo por @{model_name}",
                 "supported_action_types": ["dashboard"],
                 "icon_data_uri": "data:image/svg+xml;base64,PHN2ZyB4bWxucz0iaHR0cDovL3d3dy53My5vcmcvMjAwMC9zdmciIHdpZHRoPSIyNCIgaGVpZ2h0PSIyNCIgdmlld0JveD0iMCAwIDI0IDI0IiBmaWxsPSJub25lIiBzdHJva2U9IiM1OGE2ZmYiIHN0cm9rZS13aWR0aD0iMiI+PHBhdGggZD0iTTIxIDE1djRhMiAyIDAgMCAxLTIgMkg1YTIgMiAwIDAgMS0yLTJ2LTQiLz48cG9seWxpbmUgcG9pbnRzPSIxNyA4IDEyIDMgNyA4Ii8+PGxpbmUgeDE9IjEyIiB5MT0iMyIgeDI9IjEyIiB5Mj0iMTUiLz48L3N2Zz4=",
-                "form_url": f"{FUNCTION_URL}/form",
-                "url": f"{FUNCTION_URL}/execute",
+                "form_url": f"{base_url}/form",
+                "url": f"{base_url}/execute",
                 "supported_formats": ["txt"],
                 "params": [],
             }
         ],
-    })
+    }
+
+
+def _get_base_url(proto: str, host: str, path: str) -> str:
+    """Reconstruye la URL pública de la función a partir del request."""
+    path = path.rstrip("/")
+    for suffix in ("/form", "/execute"):
+        if path.endswith(suffix):
+            path = path[: -len(suffix)]
+            break
+    return f"{proto}://{host}{path}"
+
+
+# Las respuestas de descubrimiento y formulario no dependen del request
+# (FUNCTION_URL es fijo durante la vida de la instancia), así que se
+# serializan una sola vez al arrancar. Sin FUNCTION_URL se construyen a
+# demanda y se cachean por (proto, host, path) del request; el límite evita
+# que Host arbitrarios hagan crecer la caché sin control.
+_ACTION_LIST_BODY = _json_dumps(_action_list_payload(FUNCTION_URL)) if FUNCTION_URL else None
+_ACTION_LIST_CACHE = {}
+_ACTION_LIST_CACHE_MAX = 16
+
+_ACTION_FORM_BODY = _json_dumps([
+    {
+        "name": "dashboard_id",
+        "label": "Dashboard ID",
+        "description": "ID del dashboard en Looker a actualizar en base_project",
+        "type": "text",
+        "required": True,
+    },
+    {
+        "name": "confirm",
+        "label": "Confirmar actualización",
+        "description": "¿Seguro que quieres actualizar este dashboard?",
+        "type": "select",
+        "required": True,
+        "options": [
+            {"name": "yes", "label": "✅ Sí, actualizar"},
+            {"name": "no", "label": "❌ No, cancelar"},
+        ],
+        "default": "yes",
+    },
+])
+
+
+def _action_list(request):
+    """Devuelve el listado de acciones disponibles (descubrimiento)."""
+    if _ACTION_LIST_BODY is not None:
+        return (_ACTION_LIST_BODY, 200, _JSON_HEADERS)
+
+    key = (request.headers.get("X-Forwarded-Proto", request.scheme), request.host, request.path)
+    body = _ACTION_LIST_CACHE.get(key)
+    if body is None:
+        body = _json_dumps(_action_list_payload(_get_base_url(*key)))
+        if len(_ACTION_LIST_CACHE) >= _ACTION_LIST_CACHE_MAX:
+            _ACTION_LIST_CACHE.clear()
+        _ACTION_LIST_CACHE[key] = body
+    return (body, 200, _JSON_HEADERS)
 
 
 def _action_form():
     """Devuelve el formulario dinámico de la acción."""
-    return _json_response([
-        {
-            "name": "dashboard_id",
-            "label": "Dashboard ID",
-            "description": "ID del dashboard en Looker a actualizar en base_project",
-            "type": "text",
-            "required": True,
-        },
-        {
-            "name": "confirm",
-            "label": "Confirmar actualización",
-            "description": "¿Seguro que quieres actualizar este dashboard?",
-            "type": "select",
-            "required": True,
-            "options": [
-                {"name": "yes", "label": "✅ Sí, actualizar"},
-                {"name": "no", "label": "❌ No, cancelar"},
-            ],
-            "default": "yes",
-        },
-    ])
+    return (_ACTION_FORM_BODY, 200, _JSON_HEADERS)
 
 
 def _action_execute(body):
@@ -127,10 +285,22 @@ def _action_execute(body):
             "looker": {"success": False, "message": "Falta el Dashboard ID."}
         }, 400)
 
-    result = trigger_github_workflow(dashboard_id)
+    # Síncrono salvo con ASYNC_DISPATCH, y también si ya hay demasiados
+    # dispatches en curso, para no acumular trabajo que se perdería al apagar
+    # la instancia.
+    if not ASYNC_DISPATCH or not _DISPATCH_SLOTS.acquire(blocking=False):
+        result = trigger_github_workflow(dashboard_id)
+        return _json_response({
+            "looker": {"success": result["ok"], "message": result["message"]}
+        })
+
+    _DISPATCH_EXECUTOR.submit(_dispatch_in_background, dashboard_id)
 
     return _json_response({
-        "looker": {"success": result["ok"], "message": result["message"]}
+        "looker": {
+            "success": True,
+            "message": f"Actualización encolada para dashboard {dashboard_id}",
+        }
     })
 
 
@@ -151,35 +321,39 @@ def looker_action(request):
     - POST con form_params → Ejecución (execute)
     """
     method = request.method
-    body = request.get_json(silent=True) or {}
-
-    print(f"[ACTION HUB] {method} | body keys: {list(body.keys())}", file=sys.stderr)
 
     try:
         # GET → Descubrimiento
         if method == "GET":
-            return _action_list()
+            return _action_list(request)
 
         # POST → Distinguir entre test, form y execute por el contenido
         if method == "POST":
+            try:
+                body = _json_loads(request.get_data(cache=False) or b"{}") or {}
+            except ValueError:
+                body = {}
+
+            logger.debug("[ACTION HUB] POST | body keys: %s", body.keys())
+
             # Si tiene form_params → es una ejecución
             if "form_params" in body:
-                print(f"[ACTION HUB] EXECUTE: form_params={body['form_params']}", file=sys.stderr)
+                logger.info("[ACTION HUB] EXECUTE: form_params=%s", body["form_params"])
                 return _action_execute(body)
 
             # Si tiene data/scheduled_plan → Looker pide el formulario
             if "data" in body or "scheduled_plan" in body:
-                print("[ACTION HUB] FORM request", file=sys.stderr)
+                logger.debug("[ACTION HUB] FORM request")
                 return _action_form()
 
             # Body vacío → Looker descubriendo integraciones (puede ser GET o POST)
-            print("[ACTION HUB] Discovery via POST (empty body)", file=sys.stderr)
-            return _action_list()
+            logger.debug("[ACTION HUB] Discovery via POST (empty body)")
+            return _action_list(request)
 
         return _json_response({"error": "Method not allowed"}, 405)
 
     except Exception as e:
-        print(f"[ACTION HUB] ERROR: {e}", file=sys.stderr)
+        logger.error("[ACTION HUB] ERROR: %s", e)
         return _json_response({
             "looker": {"success": False, "message": f"Error: {str(e)}"}
         }, 500)
@@ -1,50 +1,137 @@
 import argparse
+import hashlib
 import json
+import mmap
 import os
 import re
 import sys
-import looker_sdk
-import requests
+import tempfile
 import yaml
 
+# libyaml C bindings when available (needs libyaml-dev at PyYAML build time)
+try:
+    from yaml import CSafeLoader as _Loader, CSafeDumper as _DumperBase
+except ImportError:
+    from yaml import SafeLoader as _Loader, SafeDumper as _DumperBase
+
+_RE_URL = re.compile(r'url:\s*"([^"]+)"')
+_RE_GH = re.compile(r"github\.com/([^/]+)/([^/.]+)")
+_RE_REF = re.compile(r'ref:\s*"([^"]+)"')
+_RE_MODEL = re.compile(r'override_constant:\s*model_name\s*\{[^}]*value:\s*"([^"]+)"', re.DOTALL)
+# Whole id/slug/preferred_slug lines (indentation 2-4 spaces = dashboard level)
+_RE_CLEAN = re.compile(r"^[^\S\n]{2,4}(?:id|slug|preferred_slug)[^\S\n]*:[^\n]*(?:\n|\Z)", re.MULTILINE)
+_RE_COMMIT_SHA = re.compile(r"[0-9a-f]{40}")
+_RE_MODEL_REPL = re.compile(r'(model:\s*)(?:\"[^\"]*\"|[@\w{}]+)')
+# Bytes patterns: dashboard files are scanned through mmap without decoding.
+# The name runs up to its delimiter, since bytes \w is ASCII-only and titles
+# like "Ventas del año" produce non-ASCII names; optional quotes are not captured
+_RE_EXTENDS_FLOW = re.compile(rb"""extends:\s*\[\s*["']?([^\]\s,"']+)["']?\s*\]""")
+_RE_EXTENDS_BLOCK = re.compile(rb"""extends:\s*\n\s+-\s+["']?([^\s"']+)""")
+
 def parse_tenant_manifest(manifest_path: str) -> dict:
     with open(manifest_path, "r", encoding="utf-8") as f:
         content = f.read()
 
     info = {}
 
-    url_match = re.search(r'url:\s*"([^"]+)"', content)
+    url_match = _RE_URL.search(content)
     if url_match:
         info["base_repo_url"] = url_match.group(1)
-        gh_match = re.search(r"github\.com/([^/]+)/([^/.]+)", info["base_repo_url"])
+        gh_match = _RE_GH.search(info["base_repo_url"])
         if gh_match:
             info["base_owner"] = gh_match.group(1)
             info["base_repo"] = gh_match.group(2)
 
-    ref_match = re.search(r'ref:\s*"([^"]+)"', content)
+    ref_match = _RE_REF.search(content)
     if ref_match:
         info["base_ref"] = ref_match.group(1)
 
-    model_match = re.search(
-        r'override_constant:\s*model_name\s*\{[^}]*value:\s*"([^"]+)"',
-        content,
-        re.DOTALL,
-    )
+    model_match = _RE_MODEL.search(content)
     if model_match:
         info["model_name"] = model_match.group(1)
 
     return info
 
+_SESSION = None
+
+def _get_session():
+    # requests is imported lazily: --help and the pure LookML helpers don't need it
+    global _SESSION
+    if _SESSION is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        _SESSION = requests.Session()
+        _SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+    return _SESSION
+
+# Conditional-GET cache for base dashboards: one <key hash>.lookml per file,
+# holding the ETag on its first line and the body after it
+_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "update_tenant_dashboard",
+)
+
+def _cache_path(owner: str, repo: str, ref: str, path: str) -> str:
+    key = hashlib.sha256(f"{owner}/{repo}/{ref}/{path}".encode("utf-8")).hexdigest()
+    return os.path.join(_CACHE_DIR, f"{key}.lookml")
+
+def _read_cached_base(cache_path: str) -> tuple[str, str] | None:
+    try:
+        with open(cache_path, "r", encoding="utf-8", newline="") as f:
+            content = f.read()
+    except OSError:
+        return None
+    etag, sep, body = content.partition("\n")
+    if not sep or not etag:
+        return None
+    return etag, body
+
+def _write_cached_base(cache_path: str, etag: str, body: str) -> None:
+    # ETag and body go in one file swapped in with os.replace, so a crash or a
+    # concurrent run can never pair an ETag with a truncated or different body
+    try:
+        os.makedirs(_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=_CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+                f.write(f"{etag}\n{body}")
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        print(f"Could not cache base dashboard: {e}")
+
 def get_base_dashboard_from_github(owner: str, repo: str, ref: str, dashboard_name: str, gh_token: str) -> str | None:
+    # raw.githubusercontent.com serves the file verbatim and doesn't count
+    # against the REST API rate limit, but its CDN caches for up to 5 minutes.
+    # Only a commit SHA is immutable; branches and tags go through the
+    # contents API, which is always current
     path = f"dashboards/{dashboard_name}.dashboard.lookml"
-    url = f"https://api.github.com/repos/{owner}/{repo}/contents/{path}?ref={ref}"
-    headers = {
-        "Accept": "application/vnd.github.v3.raw",
-        "Authorization": f"Bearer {gh_token}",
-    }
-
-    resp = requests.get(url, headers=headers, timeout=15)
+    if _RE_COMMIT_SHA.fullmatch(ref):
+        url = f"https://raw.githubusercontent.com/{owner}/{repo}/{ref}/{path}"
+        headers = {}
+    else:
+        url = f"https://api.github.com/repos/{owner}/{repo}/contents/{path}?ref={ref}"
+        headers = {"Accept": "application/vnd.github.v3.raw"}
+    # The token is still needed for private repos
+    if gh_token:
+        headers["Authorization"] = f"Bearer {gh_token}"
+
+    cache_path = _cache_path(owner, repo, ref, path)
+    cached = _read_cached_base(cache_path)
+    if cached:
+        headers["If-None-Match"] = cached[0]
+
+    resp = _get_session().get(url, headers=headers, timeout=15)
+    if resp.status_code == 304 and cached:
+        print(f"Base dashboard '{dashboard_name}' unchanged in base@{ref}, using cache")
+        return cached[1]
     if resp.status_code == 200:
+        etag = resp.headers.get("ETag")
+        if etag:
+            _write_cached_base(cache_path, etag, resp.text)
         return resp.text
     elif resp.status_code == 404:
         print(f"Dashboard '{dashboard_name}' not found in base@{ref}")
@@ -53,14 +140,29 @@ def get_base_dashboard_from_github(owner: str, repo: str, ref: str, dashboard_na
         print(f"Error {resp.status_code} fetching base dashboard: {resp.text}")
         return None
 
+_INTERNED_VALUE_KEYS = frozenset(("type", "comparison_type", "name"))
+
+def _intern_tree(data):
+    # Keys and enum-like values repeat across every element; share one str each
+    if isinstance(data, dict):
+        return {
+            (sys.intern(k) if type(k) is str else k): (
+                sys.intern(v) if type(v) is str and k in _INTERNED_VALUE_KEYS else _intern_tree(v)
+            )
+            for k, v in data.items()
+        }
+    if isinstance(data, list):
+        return [_intern_tree(item) for item in data]
+    return data
+
 def parse_dashboard_yaml(lookml: str) -> dict:
-    docs = yaml.safe_load(lookml)
+    docs = _intern_tree(yaml.load(lookml, Loader=_Loader))
     if isinstance(docs, list) and len(docs) > 0:
         return docs[0]
     return docs or {}
 
 # YAML flow-style helpers for LookML output
-class LookMLDumper(yaml.SafeDumper):
+class LookMLDumper(_DumperBase):
     pass
 
 class FlowList(list):
@@ -69,109 +171,128 @@ class FlowList(list):
 class FlowDict(dict):
     pass
 
+class QuotedStr(str):
+    pass
+
 LookMLDumper.add_representer(FlowList, lambda dumper, data: dumper.represent_sequence('tag:yaml.org,2002:seq', data, flow_style=True))
 LookMLDumper.add_representer(FlowDict, lambda dumper, data: dumper.represent_mapping('tag:yaml.org,2002:map', data, flow_style=True))
+LookMLDumper.add_representer(QuotedStr, lambda dumper, data: dumper.represent_scalar('tag:yaml.org,2002:str', str(data), style='"'))
+
+_FLOW_KEYS = frozenset(("extends", "fields", "sorts", "listens_to_filters", "listen"))
 
 def wrap_flow_structures(data):
+    # Mutates in place: the parsed tree is only used to feed yaml.dump
     if isinstance(data, dict):
-        new_dict = {}
         for k, v in data.items():
-            if k in ["extends", "fields", "sorts", "listens_to_filters", "listen"]:
+            if k in _FLOW_KEYS:
                 if isinstance(v, list):
-                    new_dict[k] = FlowList(v)
+                    data[k] = FlowList(v)
                 elif isinstance(v, dict):
-                    new_dict[k] = FlowDict(v)
-                else:
-                    new_dict[k] = v
+                    data[k] = FlowDict(v)
             else:
-                new_dict[k] = wrap_flow_structures(v)
-        return new_dict
+                wrap_flow_structures(v)
     elif isinstance(data, list):
-        return [wrap_flow_structures(item) for item in data]
+        for item in data:
+            wrap_flow_structures(item)
     return data
 
+_VOLATILE_KEYS = frozenset(("id", "slug", "preferred_slug"))
+_VOLATILE_KEYS_WITH_MODEL = _VOLATILE_KEYS | {"model"}
+
+_NOISY_DEFAULTS = {
+    "show_view_names": False,
+    "show_comparison": False,
+    "comparison_type": "value",
+    "comparison_reverse_colors": False,
+    "show_comparison_label": True,
+    "enable_conditional_formatting": False,
+    "conditional_formatting_include_totals": False,
+    "conditional_formatting_include_nulls": False,
+    "defaults_version": 1,
+    "tab_name": "",
+    "hidden": False,
+    "transpose": False,
+    "truncate_text": True,
+    "hide_totals": False,
+    "hide_row_totals": False,
+    "size_to_fit": True,
+    "row": None,
+    "col": None,
+    "width": None,
+    "height": None,
+}
+
+_SENTINEL = object()
+
 def normalize_element(element: dict, remove_model: bool = False) -> dict:
     normalized = dict(element)
 
-    for key in ("id", "slug", "preferred_slug"):
-        normalized.pop(key, None)
-
-    if remove_model:
-        normalized.pop("model", None)
-
-    noisy_defaults = {
-        "show_view_names": False,
-        "show_comparison": False,
-        "comparison_type": "value",
-        "comparison_reverse_colors": False,
-        "show_comparison_label": True,
-        "enable_conditional_formatting": False,
-        "conditional_formatting_include_totals": False,
-        "conditional_formatting_include_nulls": False,
-        "defaults_version": 1,
-        "tab_name": "",
-        "hidden": False,
-        "transpose": False,
-        "truncate_text": True,
-        "hide_totals": False,
-        "hide_row_totals": False,
-        "size_to_fit": True,
-        "row": None,
-        "col": None,
-        "width": None,
-        "height": None,
-    }
-
-    for key, default_val in noisy_defaults.items():
-        if key in normalized and normalized[key] == default_val:
-            normalized.pop(key)
+    # One .get probe per noisy default instead of `in` + `[]`
+    volatile = _VOLATILE_KEYS_WITH_MODEL if remove_model else _VOLATILE_KEYS
+    drop = [k for k in volatile if k in normalized]
+    drop += [k for k, v in _NOISY_DEFAULTS.items() if normalized.get(k, _SENTINEL) == v]
+    for k in drop:
+        del normalized[k]
 
     return normalized
 
 def compare_elements(tenant_elements: list, base_elements: list) -> list:
-    base_by_name = {el.get("name", ""): el for el in base_elements if el.get("name")}
+    base_norm_by_name = {
+        el.get("name", ""): normalize_element(el, remove_model=True)
+        for el in base_elements if el.get("name")
+    }
 
     diff_elements = []
     for tenant_el in tenant_elements:
         name = tenant_el.get("name", "")
-        tenant_norm = normalize_element(tenant_el, remove_model=True)
 
-        if name not in base_by_name:
+        if name not in base_norm_by_name:
+            diff_elements.append(tenant_el)
+        elif normalize_element(tenant_el, remove_model=True) != base_norm_by_name[name]:
             diff_elements.append(tenant_el)
-        else:
-            base_norm = normalize_element(base_by_name[name], remove_model=True)
-            if tenant_norm != base_norm:
-                diff_elements.append(tenant_el)
 
     return diff_elements
 
 def compare_filters(tenant_filters: list, base_filters: list) -> list:
-    base_by_name = {f.get("name", ""): f for f in base_filters}
+    base_norm_by_name = {f.get("name", ""): normalize_element(f, remove_model=True) for f in base_filters}
 
     diff_filters = []
     for tenant_f in tenant_filters:
         name = tenant_f.get("name", "")
-        tenant_norm = normalize_element(tenant_f, remove_model=True)
 
-        if name not in base_by_name:
+        if name not in base_norm_by_name:
+            diff_filters.append(tenant_f)
+        elif normalize_element(tenant_f, remove_model=True) != base_norm_by_name[name]:
             diff_filters.append(tenant_f)
-        else:
-            base_norm = normalize_element(base_by_name[name], remove_model=True)
-            if tenant_norm != base_norm:
-                diff_filters.append(tenant_f)
 
     return diff_filters
 
-def replace_model_name(lookml: str, target_model: str = "@{model_name}") -> str:
-    if not target_model.startswith("@{"):
-        replacement = f'"{target_model}"'
-    else:
-        replacement = target_model
+def clean_lookml(lookml: str) -> str:
+    cleaned = _RE_CLEAN.sub("", lookml)
+    # A dropped last line must not leave the previous line's newline behind
+    if cleaned.endswith("\n") and not lookml.endswith("\n"):
+        cleaned = cleaned[:-1]
+    return cleaned
 
-    lookml = re.sub(r'(model:\s*)(?:\"[^\"]*\"|[@\w{}]+)', rf'\1{replacement}', lookml)
+def replace_model_name(lookml: str, target_model: str = "@{model_name}") -> str:
+    # Always double-quoted: a plain scalar can't start with "@"
+    lookml = _RE_MODEL_REPL.sub(rf'\1"{target_model}"', lookml)
     return lookml
 
+def set_model_name(data, model: str):
+    # Rewrites every "model" key in the parsed tree (dashboard, elements, filters)
+    if isinstance(data, dict):
+        for k, v in data.items():
+            if k == "model":
+                data[k] = model
+            else:
+                set_model_name(v, model)
+    elif isinstance(data, list):
+        for item in data:
+            set_model_name(item, model)
+
 def dump_lookml_yaml(data: dict, tenant_model: str = "") -> str:
+    set_model_name(data, QuotedStr(tenant_model or "@{model_name}"))
     wrapped = wrap_flow_structures(data)
     output = yaml.dump(
         [wrapped],
@@ -185,11 +306,6 @@ def dump_lookml_yaml(data: dict, tenant_model: str = "") -> str:
     if not output.startswith("---\n"):
         output = "---\n" + output
 
-    if tenant_model:
-        output = replace_model_name(output, tenant_model)
-    else:
-        output = replace_model_name(output)
-
     return output
 
 def generate_extends_dashboard(dashboard_name, tenant_name, base_dashboard_name, diff_elements, diff_filters, tenant_title="", tenant_model=""):
@@ -206,31 +322,42 @@ def generate_extends_dashboard(dashboard_name, tenant_name, base_dashboard_name,
 
     return dump_lookml_yaml(dashboard, tenant_model)
 
-def generate_standalone_dashboard(lookml: str, tenant_model: str = "") -> str:
+def generate_standalone_dashboard(lookml: str, tenant_model: str = "", reshape: bool = False) -> str:
+    if not reshape:
+        # Looker already returns valid LookML: clean it textually, no YAML round-trip
+        output = replace_model_name(clean_lookml(lookml), tenant_model or "@{model_name}")
+        if not output.startswith("---\n"):
+            output = "---\n" + output
+        return output
+
     parsed = parse_dashboard_yaml(lookml)
     if not parsed:
         return lookml
     return dump_lookml_yaml(parsed, tenant_model)
 
-def detect_base_dashboard_name(dashboards_dir: str, dashboard_name: str) -> str | None:
+def locate_dashboard_file(dashboards_dir: str, dashboard_name: str, detect_extends: bool = True) -> tuple[str | None, str | None]:
+    # Single open: returns (existing path or None, base dashboard it extends or None)
     filepath = os.path.join(dashboards_dir, f"{dashboard_name}.dashboard.lookml")
-    if not os.path.exists(filepath):
-        return None
-
-    with open(filepath, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    # Flow style: extends: [name]
-    match = re.search(r"extends:\s*\[(\w+)\]", content)
-    if match:
-        return match.group(1)
-
-    # Block style: extends:\n  - name
-    match = re.search(r"extends:\s*\n\s+-\s+(\w+)", content)
-    if match:
-        return match.group(1)
-
-    return None
+    try:
+        f = open(filepath, "rb")
+    except FileNotFoundError:
+        return None, None
+
+    with f:
+        if not detect_extends or os.fstat(f.fileno()).st_size == 0:
+            return filepath, None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            # Flow style: extends: [name]
+            match = _RE_EXTENDS_FLOW.search(content)
+            if match:
+                return filepath, match.group(1).decode("utf-8")
+
+            # Block style: extends:\n  - name
+            match = _RE_EXTENDS_BLOCK.search(content)
+            if match:
+                return filepath, match.group(1).decode("utf-8")
+
+    return filepath, None
 
 def process_dashboard(sdk, dashboard_id: str, args) -> dict:
 
@@ -241,17 +368,16 @@ def process_dashboard(sdk, dashboard_id: str, args) -> dict:
     raw_lookml = result.lookml
 
     # Use dashboard title as filename
-    dash = sdk.dashboard(dashboard_id)
+    dash = sdk.dashboard(dashboard_id, fields="title")
     dashboard_name = dash.title.replace(" ", "_").lower()
     print(f"Dashboard detected: '{dashboard_name}'")
 
     dashboards_dir = os.path.abspath("dashboards")
     manifest_path = os.path.join(".", "manifest.lkml")
 
-    # Determine if this dashboard extends a base
-    base_dashboard_name = args.base_dashboard
-    if not base_dashboard_name:
-        base_dashboard_name = detect_base_dashboard_name(dashboards_dir, dashboard_name)
+    # Determine if this dashboard already exists and which base it extends
+    existing, detected_base = locate_dashboard_file(dashboards_dir, dashboard_name, detect_extends=not args.base_dashboard)
+    base_dashboard_name = args.base_dashboard or detected_base
 
     # Get tenant info from manifest
     tenant_model = args.tenant_name
@@ -301,15 +427,22 @@ def process_dashboard(sdk, dashboard_id: str, args) -> dict:
     else:
         # NEW dashboard (no extend)
         print(f"New dashboard (no base extend). Model: {tenant_model}")
-        output = generate_standalone_dashboard(raw_lookml, tenant_model=tenant_model)
+        output = generate_standalone_dashboard(raw_lookml, tenant_model=tenant_model, reshape=True)
 
     # Save
-    filepath = os.path.join(dashboards_dir, f"{dashboard_name}.dashboard.lookml")
-    action = "UPDATED" if os.path.exists(filepath) else "CREATED"
-
-    os.makedirs(dashboards_dir, exist_ok=True)
-    with open(filepath, "w", encoding="utf-8") as f:
-        f.write(output)
+    filepath = existing or os.path.join(dashboards_dir, f"{dashboard_name}.dashboard.lookml")
+    action = "UPDATED" if existing else "CREATED"
+
+    if not existing:
+        os.makedirs(dashboards_dir, exist_ok=True)
+    # Pre-encoded bytes straight to the fd, no TextIOWrapper
+    data = memoryview(output.encode("utf-8"))
+    fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
     print(f"Dashboard {action}: {filepath}")
 
     return {
@@ -333,6 +466,8 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    import looker_sdk
+
     print("Connecting to Looker API")
     sdk = looker_sdk.init40()
 
@@ -350,8 +485,10 @@ if __name__ == "__main__":
     github_output = os.environ.get("GITHUB_OUTPUT")
     if github_output:
         with open(github_output, "a") as f:
-            f.write(f"dashboard_names={json.dumps([r['dashboard_name'] for r in results])}\n")
-            f.write(f"dashboard_count={len(results)}\n")
+            f.write(
+                f"dashboard_names={json.dumps([r['dashboard_name'] for r in results])}\n"
+                f"dashboard_count={len(results)}\n"
+            )
 
     if errors:
         sys.exit(1)